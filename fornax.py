@@ -1,25 +1,225 @@
+import functools
+import io
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import logging
-import threading
-from pathlib import Path
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 
 import numpy as np
 
-from astropy.utils.data import download_file
+from astropy.io.votable import parse as votableparse
+from astropy.io.votable.ucd import parse_ucd
 from astropy.utils.console import ProgressBarOrSpinner
 import pyvo
 
 import boto3
 import botocore
+from boto3.s3.transfer import TransferConfig
+
+# orjson is a few times faster than the stdlib parser on the short json
+# payloads in the cloud_access column; use it when available
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(name)s | %(message)s")
 log = logging.getLogger('fornax')
 
 
-__all__ = ['get_data_product', 'DataHandler', 'AWSDataHandler', 'AWSDataHandlerError']
+__all__ = ['get_data_product', 'download_data_products', 'supported_providers',
+           'configure_http', 'DataHandler', 'AWSDataHandler', 'AWSDataHandlerError']
+
+
+# number of products above which batched datalink queries are
+# submitted with POST instead of GET, to avoid URL-length limits
+DATALINK_POST_THRESHOLD = 100
+
+# the access modes accepted in the cloud_access column, and the order in
+# which multiple access points are preferred
+ACCESS_MODES = ('open', 'region', 'restricted', 'none')
+_ACCESS_SORT_ORDER = {mode: i for i, mode in enumerate(ACCESS_MODES)}
+
+# keys that every aws entry in the cloud_access column must provide
+_REQUIRED_AWS_KEYS = ('region', 'access', 'bucket_name', 'key')
+
+
+# size of the http(s) connection pools; generous enough that threaded
+# use does not discard and re-handshake connections
+HTTP_POOL_SIZE = 32
+
+# default transfer settings for s3 downloads. Larger parts and more
+# threads than the boto3 defaults; GB-scale FITS files on fast pipes
+# scale with concurrency until the NIC saturates
+S3_TRANSFER_CONFIG = TransferConfig(multipart_chunksize=64 * 1024 * 1024,
+                                    max_concurrency=32,
+                                    io_chunksize=8 * 1024 * 1024)
+
+# files below this size are fetched with a single get_object call;
+# the s3transfer manager setup costs more than the transfer itself
+S3_SMALL_FILE_THRESHOLD = 16 * 1024 * 1024
+
+_http_session = None
+
+
+def _mount_pooled_adapters(session):
+    """Mount the fornax connection-pool adapters on a requests session.
+
+    Mounting replaces the existing adapters and with them their warm
+    connection pools, so a session that already carries the fornax
+    adapters is left untouched.
+
+    """
+    if getattr(session.adapters.get('https://'), '_fornax_pooled', False):
+        return session
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                          pool_maxsize=HTTP_POOL_SIZE, max_retries=3)
+    adapter._fornax_pooled = True
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _get_http_session():
+    """Return a shared requests session with pooled connections.
+
+    Reusing one session keeps connections alive between requests, which
+    avoids a new TCP+TLS handshake per call.
+
+    """
+    global _http_session
+    if _http_session is None:
+        _http_session = _mount_pooled_adapters(requests.Session())
+    return _http_session
+
+
+def configure_http(session=None):
+    """Set the session shared by all fornax http traffic.
+
+    Pass a preconfigured requests.Session (e.g. with auth or proxy
+    settings) to have fornax use it for on-prem probes and downloads and
+    for anonymous s3 GETs; the pooled adapters are mounted on it. With
+    no argument, a fresh default session replaces the current one.
+
+    Returns the active session.
+
+    """
+    global _http_session
+    _http_session = _mount_pooled_adapters(session or requests.Session())
+    return _http_session
+
+
+@functools.lru_cache(maxsize=16)
+def _get_s3_resource(profile=None, unsigned=False, region=None):
+    """Return a boto3 s3 resource, shared per (profile, unsigned, region).
+
+    Building a boto3 session resolves credentials and loads the service
+    model every time, which is far more expensive than any single call
+    made with it, so resources are created once and reused.
+
+    Parameters
+    ----------
+    profile : str
+        name of the user's profile for credentials in ~/.aws/config
+        or ~/.aws/credentials, if any.
+    unsigned : bool
+        If True, make anonymous (unsigned) requests.
+    region : str
+        The region of the bucket being accessed. Pinning the endpoint to
+        it avoids a 307 redirect round trip on the first request when
+        the bucket does not live in the default region.
+
+    """
+    config_pars = {'max_pool_connections': HTTP_POOL_SIZE}
+    if unsigned:
+        config_pars['signature_version'] = botocore.UNSIGNED
+    s3_config = botocore.client.Config(**config_pars)
+    session = boto3.session.Session(profile_name=profile)
+    resource_pars = {'service_name': 's3', 'config': s3_config}
+    if region is not None:
+        resource_pars['region_name'] = region
+        resource_pars['endpoint_url'] = f'https://s3.{region}.amazonaws.com'
+    return session.resource(**resource_pars)
+
+
+# per-DALResults cache of ucd -> column-name lookups
+_UCD_COLUMN_CACHE = weakref.WeakKeyDictionary()
+
+# an anchored prefix test is both cheaper and more precise than
+# searching for 'http' anywhere in the value
+_HTTP_PREFIXES = ('http://', 'https://')
+
+
+def _fieldname_with_ucd(dal_results, ucd):
+    """Find the name of the column that has the given ucd.
+
+    This is pyvo's DALResults.fieldname_with_ucd with two layers of
+    caching per results object: resolved names are kept per ucd, and the
+    parsed ucds of every field are computed once, so a lookup for a new
+    ucd costs one parse_ucd call rather than one per field.
+
+    """
+    try:
+        cache = _UCD_COLUMN_CACHE.setdefault(dal_results, {})
+    except TypeError:
+        # dal_results does not support weak references
+        return dal_results.fieldname_with_ucd(ucd)
+    if ucd not in cache:
+        if '_parsed_fields' not in cache:
+            cache['_parsed_fields'] = [
+                (field.name, set(parse_ucd(field.ucd, has_colon=True)))
+                for field in dal_results.fielddescs if field.ucd]
+        search_ucds = set(parse_ucd(ucd, has_colon=True))
+        cache[ucd] = next((name for name, field_ucds in cache['_parsed_fields']
+                           if search_ucds & field_ucds), None)
+    return cache[ucd]
+
+
+def _find_url_column(product):
+    """Find the name of the first column whose value is an http(s) url.
+
+    The resolved name is cached in the parent table meta, so the column
+    scan happens once per table rather than once per row.
+
+    Parameters
+    ----------
+    product : astropy.table.Row
+
+    """
+    table = product.table
+    cache = table.meta
+
+    cache_key = '_fornax_url_column'
+    if cache_key not in cache:
+        cache[cache_key] = None
+
+        # prefer the column whose ucd marks it as the access reference;
+        # astropy keeps ucds in the column meta, so this touches no cell
+        # values at all
+        for col in product.colnames:
+            col_meta = getattr(table[col], 'meta', None)
+            if col_meta and col_meta.get('ucd') == 'VOX:Image_AccessReference':
+                cache[cache_key] = col
+                break
+
+        if cache[cache_key] is None:
+            for col in product.colnames:
+                # use the column dtype to rule out non-string columns
+                # without fetching any cell values
+                if table[col].dtype.kind not in ('U', 'S', 'O'):
+                    continue
+                value = product[col]
+                if isinstance(value, str) and value.startswith(_HTTP_PREFIXES):
+                    cache[cache_key] = col
+                    break
+    return cache[cache_key]
 
 
 def get_data_product(product, provider='on-prem', access_url_column='access_url',
@@ -40,13 +240,12 @@ def get_data_product(product, provider='on-prem', access_url_column='access_url'
     kwargs: other arguments to be passed to DataHandler or its subclasses
     """
 
-    handler = None
-    if provider == 'on-prem':
-        handler = DataHandler(product, access_url_column)
-    elif provider == 'aws':
-        handler = AWSDataHandler(product, access_url_column, **kwargs)
-    else:
-        raise Exception(f'Unable to handle provider {provider}')
+    try:
+        handler_class = _PROVIDERS[provider]
+    except KeyError:
+        raise Exception(f'Unable to handle provider {provider}. '
+                        f'Supported providers are: {", ".join(_SUPPORTED_PROVIDERS)}')
+    handler = handler_class(product, access_url_column, **kwargs)
 
     if verbose:
         handler._summary()
@@ -55,6 +254,42 @@ def get_data_product(product, provider='on-prem', access_url_column='access_url'
         return handler
 
 
+def download_data_products(products, provider='on-prem', access_url_column='access_url',
+                           max_workers=16, **kwargs):
+    """Download several data products concurrently.
+
+    Each product is handled like in get_data_product, but the downloads
+    run in a thread pool. They are network-bound (HEAD + GET per
+    product), so overlapping them gives near-linear speedup up to the
+    connection-pool limit. The cached boto3 resources and http session
+    are shared across threads; both are thread-safe for downloads.
+
+    Parameters
+    ----------
+    products : list of astropy.table.Row
+        The data products to download.
+    provider : str
+        Data provider to use. Options are: on-prem | aws
+    access_url_column : str
+        The name of the column that contains the access url.
+    max_workers : int
+        Maximum number of concurrent downloads.
+
+    kwargs: other arguments to be passed to DataHandler or its subclasses
+
+    Returns
+    -------
+    The download results, in the same order as products.
+
+    """
+    handlers = [get_data_product(product, provider, access_url_column, verbose=False, **kwargs)
+                for product in products]
+
+    nworkers = min(max(len(handlers), 1), max_workers)
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        return list(executor.map(lambda handler: handler.download(), handlers))
+
+
 class DataHandler:
     """A base class that handles the different ways data can be accessed.
     The base implementation is to use on-prem data. Subclasses can handle
@@ -64,6 +299,8 @@ class DataHandler:
 
     """
 
+    __slots__ = ('product', 'access_url', 'processed_info', '_summary_cache')
+
     def __init__(self, product, access_url_column='access_url'):
         """Create a DataProvider object.
 
@@ -78,8 +315,21 @@ class DataHandler:
 
         """
         self.product = product
-        self.access_url = product[access_url_column]
+        try:
+            self.access_url = product[access_url_column]
+        except KeyError:
+            if isinstance(product, pyvo.dal.Record):
+                # fall back to the standard SIA ucd (cached per results),
+                # then let pyvo locate the data url itself; no need to
+                # scan the columns for records
+                url_column = _fieldname_with_ucd(product._results, 'VOX:Image_AccessReference')
+                self.access_url = product[url_column] if url_column else product.getdataurl()
+            else:
+                # plain rows: scan for an http(s) value, cached per table
+                url_column = _find_url_column(product)
+                self.access_url = product[url_column] if url_column else None
         self.processed_info = None
+        self._summary_cache = None
 
     def process_data_info(self):
         """Process data product info """
@@ -92,25 +342,336 @@ class DataHandler:
 
     def _summary(self):
         """A str representation of the data handler"""
-        info = self.process_data_info()
-        print('\n---- Summary ----')
-        for key, value in info.items():
-            print(f'{key:12}: {value}')
-        print('-----------------\n')
+        # the text only depends on processed_info, which is itself
+        # cached, so build it once with a join and keep it
+        if self._summary_cache is None:
+            info = self.process_data_info()
+            lines = ['', '---- Summary ----']
+            lines += [f'{key:12}: {value}' for key, value in info.items()]
+            lines += ['-----------------', '']
+            self._summary_cache = '\n'.join(lines)
+        print(self._summary_cache)
+
+    def is_accessible(self):
+        """Check that the access url can be reached.
+
+        A GET for the first byte is used rather than HEAD; some servers
+        answer HEAD with 405 or inaccurate metadata, while a one-byte
+        ranged GET confirms access, reports the true size through the
+        Content-Range header, and warms the server's cache for the
+        download that usually follows.
 
-    def download(self):
+        Return
+        -----
+        (accessible, msg) where accessible is a bool and msg is the failure message
+
+        """
+        if self.access_url is None:
+            return False, 'No access url.'
+        try:
+            session = _get_http_session()
+            response = session.get(self.access_url, headers={'Range': 'bytes=0-0'},
+                                   stream=True, timeout=10)
+            response.close()
+        except requests.RequestException as e:
+            return False, str(e)
+        if response.status_code in (200, 206):
+            return True, ''
+        return False, f'HTTP {response.status_code}'
+
+    def download(self, local_path=None, cache=True):
         """Download data. Can be overloaded with different implimentation"""
         info = self.process_data_info()
-        return download_file(info['access_url'])
+        return _download_file_http(info['access_url'], local_path=local_path, cache=cache)
 
 
 class AWSDataHandlerError(Exception):
     pass
 
 
+# cache of head_object probes, keyed by (resource id, bucket, key) and
+# holding (accessible, message, header). Shared across handlers so
+# duplicate access points are only probed once
+_HEAD_CACHE = {}
+
+
+def _prime_head_cache(s3_resource, bucket_name, keys):
+    """Fill _HEAD_CACHE for several keys of one bucket with one listing.
+
+    A single list_objects_v2 call under the keys' common prefix replaces
+    one head_object round-trip per key. Failures are ignored; the keys
+    simply stay uncached and fall back to per-key head_object checks.
+
+    """
+    prefix = os.path.commonprefix(list(keys))
+    if not prefix:
+        # no shared prefix; a listing could walk the whole bucket
+        return
+
+    found = {}
+    try:
+        paginator = s3_resource.meta.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for entry in page.get('Contents', []):
+                found[entry['Key']] = entry
+    except Exception as e:
+        log.info(f'bulk listing of {bucket_name} failed: {e}')
+        return
+
+    for key in keys:
+        cache_key = (id(s3_resource), bucket_name, key)
+        if cache_key in _HEAD_CACHE:
+            continue
+        entry = found.get(key)
+        if entry is None:
+            _HEAD_CACHE[cache_key] = (False, f'{key} not found in {bucket_name}.', None)
+        else:
+            header = {'ContentLength': entry['Size'], 'ETag': entry['ETag']}
+            _HEAD_CACHE[cache_key] = (True, '', header)
+
+
+def _read_sidecar(local_path):
+    """Return the metadata recorded next to a downloaded file, if any."""
+    try:
+        with open(f'{local_path}.fornaxmeta') as fh:
+            return _json_loads(fh.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_sidecar(local_path, meta):
+    """Record download metadata next to the file, for later cache checks."""
+    try:
+        with open(f'{local_path}.fornaxmeta', 'w') as fh:
+            fh.write(json.dumps(meta))
+    except OSError:
+        # the sidecar is an optimization; losing it only costs a HEAD
+        pass
+
+
+def _download_file_http(access_url, local_path=None, cache=True):
+    """Download an http(s) url, revalidating any cached copy.
+
+    astropy's download_file caches by url alone, gives no control over
+    the local path, and never revalidates. Here the ETag/Last-Modified
+    headers of the first fetch are kept in a sidecar next to the file;
+    later calls send If-None-Match/If-Modified-Since, and an unchanged
+    file answers 304 with no payload.
+
+    Returns the local path of the downloaded (or still valid) file.
+
+    """
+    if local_path is None:
+        local_path = access_url.rstrip('/').rpartition('/')[2] or 'fornax-download'
+
+    session = _get_http_session()
+
+    headers = {}
+    if cache and os.path.exists(local_path):
+        meta = _read_sidecar(local_path)
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+    response = session.get(access_url, headers=headers, stream=True, timeout=60)
+    if response.status_code == 304:
+        response.close()
+        log.info(f'Cached file {local_path} is up to date.')
+        return local_path
+    response.raise_for_status()
+
+    length = response.headers.get('Content-Length')
+    length = int(length) if length else None
+    with ProgressBarOrSpinner(length, (f'Downloading {access_url} to {local_path} ...')) as pb:
+        nbytes = 0
+        with open(local_path, 'wb') as fh:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                fh.write(chunk)
+                nbytes += len(chunk)
+                pb.update(nbytes)
+
+    _write_sidecar(local_path, {'content_length': nbytes,
+                                'etag': response.headers.get('ETag'),
+                                'last_modified': response.headers.get('Last-Modified')})
+    return local_path
+
+
+# per-DALResults cache of the resolved datalink service information
+_DATALINK_CACHE = weakref.WeakKeyDictionary()
+
+
+def _get_datalink_info(dal_results):
+    """Resolve the datalink service information for a results object.
+
+    Walking the VOTable resource tree for the adhoc service, the 'source'
+    parameter and the id column is pure re-computation after the first
+    call, so the result is cached per results object.
+
+    Returns
+    -------
+    (dlink_resource, source_elem, id_colname) where source_elem is None
+    if the service has no 'source' parameter, and id_colname is None if
+    the input params reference no field of the results.
+
+    """
+    try:
+        cached = _DATALINK_CACHE.get(dal_results)
+    except TypeError:
+        cached = None
+    if cached is not None:
+        return cached
+
+    dlink_resource = dal_results.get_adhocservice_by_ivoid(pyvo.dal.adhoc.DATALINK_IVOID)
+
+    # Look for the 'source' <PARAM> element inside the inputParams <GROUP> element.
+    # pyvo already handles part of this.
+    source_elems = [p for p in dlink_resource.groups[0].entries if p.name == 'source']
+    source_elem = source_elems[0] if source_elems else None
+
+    # name of the column used to match datalink result rows to the products
+    id_colname = None
+    if source_elem is not None:
+        input_params = pyvo.dal.adhoc._get_input_params_from_resource(dlink_resource)
+        # a set, so the membership test below is O(1) per field
+        dl_col_id = {p.ref for p in input_params.values() if p.ref is not None}
+        # None (rather than IndexError) when no input param references a
+        # field of the results; callers treat it like a missing service
+        id_colname = next((f.name for f in dal_results.fielddescs if f.ID in dl_col_id),
+                          None)
+
+    info = (dlink_resource, source_elem, id_colname)
+    try:
+        _DATALINK_CACHE[dal_results] = info
+    except TypeError:
+        pass
+    return info
+
+
+def _process_cloud_datalinks(products):
+    """Extract aws access information for a list of products using datalinks.
+
+    A single batched datalink query is made for all the products, and the
+    result rows are matched back to the input products by the datalink ID
+    column, so we avoid both per-product queries and per-product filtering
+    of the datalink result table.
+
+    Parameters
+    ----------
+    products : list of pyvo.dal.Record
+        The data products. They are expected to belong to the same
+        parent pyvo.dal.DALResults.
+
+    Returns
+    -------
+    A list with one element per product. Each element is a list of dict,
+    where each dict contains the aws information (bucket_name, key, region,
+    access) extracted from one datalink result row.
+
+    """
+
+    dal_results = products[0]._results
+
+    dlink_resource, source_elem, id_colname = _get_datalink_info(dal_results)
+
+    # proceed only if we have a PARAM named source and a column to match
+    # datalink result rows back to the products
+    if source_elem is None or id_colname is None:
+        return [[] for _ in products]
+
+    # the datalink follow-ups below fan out over https; give pyvo's
+    # session the same pooled adapters so they reuse connections
+    session = getattr(dal_results, '_session', None)
+    if isinstance(session, requests.Session):
+        _mount_pooled_adapters(session)
+
+    rows_aws_info = [[] for _ in products]
+
+    # extract the id values once; indexing the records inside the
+    # per-option loop would rebuild them for every access option
+    ids = [product[id_colname] for product in products]
+
+    # list the available options in the `source` element:
+    access_options = source_elem.values.options
+    for opt in access_options:
+        provider, _, region = opt[1].partition(':')
+        if provider != 'aws':
+            continue
+
+        # do a single datalink call for all products:
+        log.info(f'doing a datalink request for {opt[1]}')
+        query = pyvo.dal.adhoc.DatalinkQuery.from_resource(
+                products, dlink_resource, session=dal_results._session,
+                source=opt[1]
+            )
+        if len(products) > DATALINK_POST_THRESHOLD:
+            # a GET with thousands of IDs exceeds typical URL-length
+            # limits, so submit large batches with POST
+            response = dal_results._session.post(query.queryurl, data=query)
+            response.raise_for_status()
+            dl_result = pyvo.dal.adhoc.DatalinkResults(
+                votableparse(io.BytesIO(response.content)),
+                url=query.queryurl, session=dal_results._session)
+        else:
+            dl_result = query.execute()
+        dl_table = dl_result.to_table()
+
+        # index the datalink result by ID once, so matching rows to
+        # products is O(1) per product instead of a table scan. Work on
+        # the plain column arrays; iterating the table would construct
+        # an astropy Row wrapper per result row
+        dl_ids = np.asarray(dl_table['ID'])
+        dl_urls = np.asarray(dl_table['access_url'])
+        # FITS-backed tables hand us bytes columns; decode them in one
+        # vectorized pass instead of once per value further down
+        if dl_ids.dtype.kind == 'S':
+            dl_ids = np.char.decode(dl_ids, 'utf-8')
+        if dl_urls.dtype.kind == 'S':
+            dl_urls = np.char.decode(dl_urls, 'utf-8')
+        if dl_ids.dtype.kind in 'iuf':
+            # numeric ids: sort once and resolve all products with two
+            # vectorized searchsorted calls, no per-id dict boxing
+            order = np.argsort(dl_ids, kind='stable')
+            sorted_ids = dl_ids[order]
+            sorted_urls = dl_urls[order]
+            lo = np.searchsorted(sorted_ids, ids, side='left')
+            hi = np.searchsorted(sorted_ids, ids, side='right')
+            row_matches = [sorted_urls[lo[i]:hi[i]] for i in range(len(products))]
+        else:
+            urls_by_id = defaultdict(list)
+            for dl_id, dl_url in zip(dl_ids, dl_urls):
+                urls_by_id[dl_id].append(dl_url)
+            urls_for_id = urls_by_id.get
+            row_matches = [urls_for_id(ids[irow], ()) for irow in range(len(products))]
+
+        for irow in range(len(products)):
+            append = rows_aws_info[irow].append
+            for access_url in row_matches[irow]:
+                # slice the uri rather than split it; no list allocation
+                # per url when merging thousands of datalink rows
+                rest = access_url[access_url.find('//') + 2:]
+                slash = rest.find('/')
+                if slash == -1:
+                    bucket_name, key = rest, '/'
+                else:
+                    bucket_name, key = rest[:slash], rest[slash:]
+                append({
+                    'bucket_name': bucket_name,
+                    'region': region,
+                    'key': key,
+                    # TODO: find a way to handle `access`
+                    'access': 'region',
+                })
+
+    return rows_aws_info
+
+
 class AWSDataHandler(DataHandler):
     """Class for managaing access to data in AWS"""
 
+    __slots__ = ('requester_pays', 'profile', '_s3_uri', 'bucket_access')
+
     def __init__(self, product, access_url_column='access_url', profile=None, requester_pays=False):
         """Handle AWS-specific authentication and data download
 
@@ -170,22 +731,19 @@ class AWSDataHandler(DataHandler):
         The same input dict with any standardization applied.
         """
 
-        meta_keys = list(info.keys())
         msg0 = ' Failed to process cloud metadata: '
 
         # check for required keys
-        required_keys = ['region', 'access', 'bucket_name', 'key']
-        for req_key in required_keys:
-            if not req_key in meta_keys:
+        for req_key in _REQUIRED_AWS_KEYS:
+            if req_key not in info:
                 msg = f'{req_key} value is missing from the cloud_acess column.'
                 raise AWSDataHandlerError(msg0 + msg)
 
         # extra checks: access has to be one of these values
-        accepted_access = ['open', 'region', 'restricted', 'none']
         access = info['access']
-        if not access in accepted_access:
+        if access not in ACCESS_MODES:
             msg  = f'Unknown access value {access}. Expected one of '
-            msg += ', '.join(accepted_access)
+            msg += ', '.join(ACCESS_MODES)
             raise AWSDataHandlerError(msg0 + msg)
 
         if info['key'][0] == '/':
@@ -230,7 +788,7 @@ class AWSDataHandler(DataHandler):
         log.info(f'data access mode: {data_access}')
 
         # check if we already have access to data_bucket
-        if data_bucket in self.bucket_access.keys():
+        if data_bucket in self.bucket_access:
             aws_access_info = self.bucket_access[data_bucket].copy()
             aws_access_info['s3_key'] = data_key
             aws_access_info['message'] += f', re-using access.'
@@ -247,8 +805,7 @@ class AWSDataHandler(DataHandler):
 
         # data have open access
         if data_access == 'open':
-            s3_config = botocore.client.Config(signature_version=botocore.UNSIGNED)
-            s3_resource = boto3.resource(service_name='s3', config=s3_config)
+            s3_resource = _get_s3_resource(unsigned=True, region=data_region)
             accessible, message = self.is_accessible(s3_resource, data_bucket, data_key)
             msg = 'Accessing public data anonymously on aws ... '
             if not accessible:
@@ -270,8 +827,7 @@ class AWSDataHandler(DataHandler):
 
                 if data_access == 'region':
                     msg = f'Accessing {data_access} data anonymously ...'
-                    s3_config = botocore.client.Config(signature_version=botocore.UNSIGNED)
-                    s3_resource = boto3.resource(service_name='s3', config=s3_config)
+                    s3_resource = _get_s3_resource(unsigned=True, region=data_region)
                     accessible, message = self.is_accessible(s3_resource, data_bucket, data_key)
                     if accessible:
                         break
@@ -282,8 +838,7 @@ class AWSDataHandler(DataHandler):
                 if self.profile is not None:
                     msg = f'Accessing {data_access} data using profile: {self.profile} ...'
                     try:
-                        s3_session = boto3.session.Session(profile_name=self.profile)
-                        s3_resource = s3_session.resource(service_name='s3')
+                        s3_resource = _get_s3_resource(profile=self.profile, region=data_region)
                         accessible, message = self.is_accessible(s3_resource, data_bucket, data_key)
                         if accessible:
                             break
@@ -296,7 +851,7 @@ class AWSDataHandler(DataHandler):
                 # If access with profile fails, attemp to use any credientials
                 # in the user system e.g. environment variables etc. boto3 should find them.
                 msg = f'Accessing {data_access} data with other credentials ...'
-                s3_resource = boto3.resource(service_name='s3')
+                s3_resource = _get_s3_resource(region=data_region)
                 accessible, message = self.is_accessible(s3_resource, data_bucket, data_key)
                 if accessible:
                     break
@@ -356,61 +911,45 @@ class AWSDataHandler(DataHandler):
 
             # if self.product is a (subclass of) pyvo pyvo.dal.Record,
             # lets try datalinks
-            # TODO: also handle pyvo.dal.DALResults (i.e. many Records)
             use_datalinks = False
             if isinstance(self.product, pyvo.dal.Record):
-                dlink_resource = self.product._results.get_adhocservice_by_ivoid(pyvo.dal.adhoc.DATALINK_IVOID)
-
-                # Look for the 'source' <PARAM> element inside the inputParams <GROUP> element.
-                # pyvo already handles part of this.
-                source_elems = [p for p in dlink_resource.groups[0].entries if p.name == 'source']
-
-                # proceed only if we have a PARAM named source,
-                # otherwise, look for the cloud_access column
-                if len(source_elems) != 0:
-                    # we have a source parameters, process it
-                    source_elem  = source_elems[0]
-
-                    # list the available options in the `source` element:
-                    access_options = source_elem.values.options
+                try:
+                    aws_info = _process_cloud_datalinks([self.product])[0]
+                except pyvo.dal.DALServiceError:
+                    # results with no datalink service at all; fall
+                    # through to the cloud_access json column
                     aws_info = []
-                    for opt in access_options:
-                        sopt = opt[1].split(':')
-                        if sopt[0] == 'aws':
-
-                            # do a datalink call:
-                            log.info(f'doing a datalink request for {opt[1]}')
-                            query = pyvo.dal.adhoc.DatalinkQuery.from_resource(
-                                    self.product, dlink_resource, self.product._results._session,
-                                    source=opt[1]
-                                )
-                            dl_result = query.execute()
-                            url = dl_result[0].access_url.split('/')
-                            bucket_name = url[2]
-                            key = '/' + ('/'.join(url[3:]))
-                            region = sopt[1]
-                            aws_info.append({
-                                'bucket_name': bucket_name,
-                                'region': region,
-                                'key': key,
-                                # TODO: find a way to handle `access`
-                                'access': 'region',
-                            })
-                    # if we have populated aws_info, then we proceed with datalinks
-                    # otherwise, fall back to the cloud_access json column
-                    if len(aws_info):
-                        use_datalinks = True
+
+                # if we have populated aws_info, then we proceed with datalinks
+                # otherwise, fall back to the cloud_access json column
+                if len(aws_info):
+                    use_datalinks = True
 
             # we do this part only when we don't have datalinks
             if not use_datalinks:
 
                 # do we have cloud_access info in the data product?
+                # (membership has to go through keys(): `in` on an
+                # astropy Row scans the cell values, not the column names)
                 if 'cloud_access' not in self.product.keys():
                     msg = 'Input product does not have any cloud access information.'
                     raise AWSDataHandlerError(msg)
 
-                # read json provided by the archive server
-                cloud_access = json.loads(self.product['cloud_access'])
+                # read json provided by the archive server. The substring
+                # screen is a C-level search, much cheaper than parsing
+                # json that certainly has no aws entry
+                cloud_access_text = self.product['cloud_access']
+                if isinstance(cloud_access_text, bytes):
+                    cloud_access_text = cloud_access_text.decode('utf-8')
+                elif type(cloud_access_text) is not str:
+                    # rows hand back numpy.str_, which orjson rejects;
+                    # it only accepts exact str/bytes input
+                    cloud_access_text = str(cloud_access_text)
+                if '"aws"' not in cloud_access_text:
+                    msg = 'No aws cloud access information in the data product.'
+                    raise AWSDataHandlerError(msg)
+
+                cloud_access = _json_loads(cloud_access_text)
 
                 # do we have information specific to aws in the data product?
                 if 'aws' not in cloud_access:
@@ -432,16 +971,38 @@ class AWSDataHandler(DataHandler):
 
             # we have multiple aws access points given as a list of dict
             elif isinstance(aws_info, list):
-                aws_access_info = [self._process_single_aws_entry(aws_i) for aws_i in aws_info]
+                # skip exact duplicates; every unique entry costs at
+                # least one network access check
+                # keys are only ambiguous within one bucket, so keep one
+                # small set per bucket rather than hashing (bucket, key)
+                # tuples into a single global set
+                seen_by_bucket = {}
+                unique_info = []
+                for aws_i in aws_info:
+                    seen = seen_by_bucket.setdefault(aws_i.get('bucket_name'), set())
+                    key = aws_i.get('key')
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    unique_info.append(aws_i)
+
+                # each entry does network i/o for the access check, so
+                # overlap them when there is more than one
+                if len(unique_info) > 1:
+                    nworkers = min(len(unique_info), HTTP_POOL_SIZE)
+                    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                        aws_access_info = list(executor.map(self._process_single_aws_entry, unique_info))
+                else:
+                    aws_access_info = [self._process_single_aws_entry(aws_i) for aws_i in unique_info]
 
                 # sort access points so that open data comes first
                 if multi_access_sort:
-                    sorter = {'open': 0, 'region': 1, 'restricted': 2, 'none': 3}
-                    aws_access_info = sorted(aws_access_info, key=lambda x: sorter[x['data_access']])
+                    aws_access_info = sorted(aws_access_info,
+                                             key=lambda x: _ACCESS_SORT_ORDER[x['data_access']])
                 info.update(aws_access_info[0])
                 info['access_points'] = aws_access_info
             else:
-                msg = f'Unrecognized aws entry: {type(access_info)}. Expected a dict or a list'
+                msg = f'Unrecognized aws entry: {type(aws_info)}. Expected a dict or a list'
                 raise AWSDataHandlerError(msg)
 
         except AWSDataHandlerError as e:
@@ -453,6 +1014,10 @@ class AWSDataHandler(DataHandler):
     def is_accessible(self, s3_resource, bucket_name, key):
         """Do a head_object call to test access
 
+        The result (including the returned header) is cached at module
+        level, so repeated checks of the same object through the same
+        resource cost one network round-trip in total.
+
         Paramters
         ---------
         s3_resource : s3.ServiceResource
@@ -468,6 +1033,13 @@ class AWSDataHandler(DataHandler):
 
         """
 
+        # s3 resources are memoized (see _get_s3_resource), so their ids
+        # are stable and can be part of the cache key
+        cache_key = (id(s3_resource), bucket_name, key)
+        if cache_key in _HEAD_CACHE:
+            accessible, msg, _ = _HEAD_CACHE[cache_key]
+            return accessible, msg
+
         s3_client = s3_resource.meta.client
 
         try:
@@ -476,10 +1048,12 @@ class AWSDataHandler(DataHandler):
         except Exception as e:
             accessible = False
             msg = str(e)
+            header_info = None
 
+        _HEAD_CACHE[cache_key] = (accessible, msg, header_info)
         return accessible, msg
 
-    def download(self, access_point=0, **kwargs):
+    def download(self, access_point=0, probe=False, **kwargs):
         """Download data, from aws if possible, else from on-prem
 
         Parameters
@@ -488,6 +1062,10 @@ class AWSDataHandler(DataHandler):
             The index (0-based) or bucket name to use when multiple access points
             are available. If only one access point is availabe, this is
             ignored.
+        probe: bool
+            If True and there are multiple access points, re-check their
+            accessibility concurrently and use the first one (in priority
+            order) that is still reachable, instead of access_point.
         **kwargs: to be passed to _download_file_s3
 
         """
@@ -495,11 +1073,43 @@ class AWSDataHandler(DataHandler):
         data_info = self.process_data_info()
 
         # if no s3_resource object, default to http download
-        if 's3_resource' in data_info.keys():
+        if 's3_resource' in data_info:
 
             # Do we have multiple access points?
             access_points = data_info['access_points']
-            if len(access_points) != 1 and access_point not in [0, data_info['s3_bucket_name']]:
+            if probe and len(access_points) > 1:
+                # probing is a fresh re-check: evict any cached results
+                # for these access points first, so earlier transient
+                # failures (or recoveries) do not answer from _HEAD_CACHE
+                for ap in access_points:
+                    _HEAD_CACHE.pop((id(ap['s3_resource']), ap['s3_bucket_name'],
+                                     ap['s3_key']), None)
+
+                # when several access points share a bucket, one listing
+                # answers all of their probes at once
+                by_bucket = defaultdict(list)
+                for ap in access_points:
+                    by_bucket[(id(ap['s3_resource']), ap['s3_bucket_name'])].append(ap)
+                for group in by_bucket.values():
+                    if len(group) > 1:
+                        _prime_head_cache(group[0]['s3_resource'], group[0]['s3_bucket_name'],
+                                          [ap['s3_key'] for ap in group])
+
+                # probe all access points at once; the checks are pure
+                # network latency, so overlapping them costs nothing
+                def _probe(ap):
+                    return self.is_accessible(ap['s3_resource'], ap['s3_bucket_name'],
+                                              ap['s3_key'])[0]
+                nworkers = min(len(access_points), HTTP_POOL_SIZE)
+                with ThreadPoolExecutor(max_workers=nworkers) as executor:
+                    accessible = list(executor.map(_probe, access_points))
+                for ap_info, ap_accessible in zip(access_points, accessible):
+                    if ap_accessible:
+                        data_info.update(ap_info)
+                        break
+                else:
+                    raise AWSDataHandlerError('None of the access points are accessible.')
+            elif len(access_points) != 1 and access_point not in [0, data_info['s3_bucket_name']]:
                 # access_point as index
                 if isinstance(access_point, int):
                     data_info.update(access_points[access_point])
@@ -514,14 +1124,10 @@ class AWSDataHandler(DataHandler):
 
             log.info('--- Downloading data from S3 ---')
             # proceed to actual download
-            self._download_file_s3(data_info, **kwargs)
+            return self._download_file_s3(data_info, **kwargs)
         else:
             log.info('--- Downloading data from On-prem ---')
-
-            # workaround, astropy.utils.data.download_file returns the location of the
-            # temp file with no control over local_path.
-            # TODO: We should pull out the download_file method from the astroquery base class instead.
-            return download_file(data_info['access_url'])
+            return _download_file_http(data_info['access_url'])
 
     def length_file_s3(self):
         """
@@ -554,7 +1160,8 @@ class AWSDataHandler(DataHandler):
         print(f'Checking length: {key=}, {ex=}, {length=}')
 
     # adapted from astroquery.mast.
-    def _download_file_s3(self, data_info, local_path=None, cache=True):
+    def _download_file_s3(self, data_info, local_path=None, cache=True, strict=True,
+                          max_concurrency=None, multipart_chunksize=None):
         """
         downloads the product used in inializing this object into
         the given directory.
@@ -566,8 +1173,29 @@ class AWSDataHandler(DataHandler):
             The local filename to which toe downloaded file will be saved.
         cache : bool
             Default is True. If file is found on disc it will not be downloaded again.
+        strict : bool
+            Default is True: cached files are revalidated against s3
+            (etag or size). If False, a cached file whose size matches
+            the sidecar is trusted without any network traffic.
+        max_concurrency : int
+            Number of threads used by boto3 to pull the parts of the file
+            in parallel. If None, use the module-level S3_TRANSFER_CONFIG.
+        multipart_chunksize : int
+            Size in bytes of each part pulled by those threads. Fewer
+            larger parts suit fast links (e.g. in-region VPC endpoints);
+            smaller parts suit slow home connections. If None, use the
+            module-level S3_TRANSFER_CONFIG.
+
+        Returns the local path of the downloaded (or still valid) file.
         """
 
+        transfer_config = S3_TRANSFER_CONFIG
+        if max_concurrency is not None or multipart_chunksize is not None:
+            transfer_config = TransferConfig(
+                max_concurrency=max_concurrency or S3_TRANSFER_CONFIG.max_concurrency,
+                multipart_threshold=8 * 1024 * 1024,
+                multipart_chunksize=multipart_chunksize or 8 * 1024 * 1024)
+
         s3 = data_info['s3_resource']
         s3_client = s3.meta.client
 
@@ -578,42 +1206,124 @@ class AWSDataHandler(DataHandler):
             raise Exception(f"Unable to locate file {key}.")
 
         if local_path is None:
-            local_path = Path(key).name
-
-        # Ask the webserver (in this case S3) what the expected content length is and use that.
-        info_lookup = s3_client.head_object(Bucket=bucket_name, Key=key)
-        length = info_lookup["ContentLength"]
-
-        if cache and os.path.exists(local_path):
-            if length is not None:
-                statinfo = os.stat(local_path)
+            local_path = key.rpartition('/')[2] or key
+
+        # public data accessed anonymously: a plain https GET to the
+        # virtual-hosted url skips botocore's per-call machinery
+        # (signer dispatch, event hooks, param validation) and gets the
+        # pooled session and conditional-GET caching for free
+        if s3_client.meta.config.signature_version is botocore.UNSIGNED:
+            region = data_info.get('data_region') or s3_client.meta.region_name
+            url = f'https://{bucket_name}.s3.{region}.amazonaws.com/{quote(key.lstrip("/"))}'
+            return _download_file_http(url, local_path=local_path, cache=cache)
+
+        # is_accessible may have already done a head_object call; reuse
+        # its answer. Otherwise do not ask eagerly: the length is only
+        # needed for the cache comparison and the progress bar, and a
+        # spinner works without it, so a fresh download of a new file
+        # costs no HEAD round trip at all
+        cached = _HEAD_CACHE.get((id(s3), bucket_name, key))
+        length = None
+        if cached is not None and cached[2] is not None:
+            length = cached[2]["ContentLength"]
+
+        # one stat call covers both the existence test and the size; a
+        # separate os.path.exists would resolve the path a second time
+        try:
+            statinfo = os.stat(local_path)
+        except FileNotFoundError:
+            statinfo = None
+
+        if cache and statinfo is not None:
+            meta = _read_sidecar(local_path)
+            if not strict:
+                # trust the local copy outright when its size matches
+                # what the last download recorded: a full cache hit is
+                # one stat syscall and no network i/o
+                expected = meta.get('content_length') if meta is not None else None
+                if expected is None or expected == statinfo.st_size:
+                    log.info(f"Found cached file {local_path}; skipping validation.")
+                    return local_path
+            etag = meta.get('etag') if meta is not None else None
+            if etag:
+                # a conditional GET validates the content itself, not
+                # just its length; on a match s3 answers 304 and no
+                # bytes are transferred
+                try:
+                    response = s3_client.get_object(Bucket=bucket_name, Key=key,
+                                                    IfNoneMatch=etag)
+                except botocore.exceptions.ClientError as e:
+                    status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+                    if status == 304:
+                        log.info(f"Found cached file {local_path} with matching etag.")
+                        return local_path
+                    raise
+                # the object changed; note its new length and redownload
+                length = response['ContentLength']
+                response['Body'].close()
+                log.info(f"Found cached file {local_path} with a stale etag.")
+            else:
+                if length is None and meta is not None:
+                    # a sidecar written by an earlier download lets the
+                    # cache hit complete with zero s3 traffic
+                    length = meta.get('content_length')
+                if length is None:
+                    length = s3_client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
                 if statinfo.st_size != length:
                     log.info(f"Found cached file {local_path} with size {statinfo.st_size} "
                              f"that is different from expected size {length}.")
                 else:
                     log.info(f"Found cached file {local_path} with expected size {statinfo.st_size}.")
-                    return
+                    return local_path
+
+        if length is not None and length < S3_SMALL_FILE_THRESHOLD:
+            # small files: one GET, streamed straight to disk, skipping
+            # the s3transfer thread-pool machinery
+            response = s3_client.get_object(Bucket=bucket_name, Key=key)
+            with ProgressBarOrSpinner(length, (f'Downloading {self.s3_uri} to {local_path} ...')) as pb:
+                nbytes = 0
+                with open(local_path, 'wb') as fh:
+                    for chunk in iter(lambda: response['Body'].read(1024 * 1024), b''):
+                        fh.write(chunk)
+                        nbytes += len(chunk)
+                        pb.update(nbytes)
+            _write_sidecar(local_path, {'content_length': nbytes,
+                                        'etag': response.get('ETag')})
+            return local_path
 
         with ProgressBarOrSpinner(length, (f'Downloading {self.s3_uri} to {local_path} ...')) as pb:
 
-            # Bytes read tracks how much data has been received so far
-            # This variable will be updated in multiple threads below
-            global bytes_read
-            bytes_read = 0
-
-            progress_lock = threading.Lock()
+            # Bytes read tracks how much data has been received so far.
+            # A closure-local cell rather than a module global, so
+            # concurrent downloads do not clobber each other. The
+            # unlocked += can drop an update under boto3's worker
+            # threads, so the count only drives the display; anything
+            # authoritative comes from the filesystem
+            bytes_read = [0]
+            last_update = [0]
 
             def progress_callback(numbytes):
-                # Boto3 calls this from multiple threads pulling the data from S3
-                global bytes_read
-
-                # This callback can be called in multiple threads
-                # Access to updating the console needs to be locked
-                with progress_lock:
-                    bytes_read += numbytes
-                    pb.update(bytes_read)
-
-            bkt.download_file(key, local_path, Callback=progress_callback)
+                # Boto3 calls this from multiple threads pulling the data
+                # from S3, roughly once per 64 KB chunk. Redrawing the
+                # console that often costs more than the transfer itself
+                # on fast links, so flush at most once per megabyte
+                bytes_read[0] += numbytes
+                if bytes_read[0] - last_update[0] >= 1024 * 1024:
+                    last_update[0] = bytes_read[0]
+                    pb.update(bytes_read[0])
+
+            bkt.download_file(key, local_path, Callback=progress_callback,
+                              Config=transfer_config)
+            pb.update(bytes_read[0])
+
+        etag = None
+        if cached is not None and cached[2] is not None:
+            etag = cached[2].get('ETag')
+        # record the on-disk size, not the progress counter: the latter
+        # is updated without a lock and may undercount
+        _write_sidecar(local_path, {'content_length': os.stat(local_path).st_size,
+                                    'etag': etag})
+        return local_path
 
     def user_on_aws(self):
         """Check if the user is in on aws
@@ -647,8 +1357,23 @@ class AWSDataHandler(DataHandler):
 
         if region is None:
             # try the link-local address
-            session = requests.session()
+            session = _get_http_session()
             response = session.get('http://169.254.169.254/latest/dynamic/instance-identity/document', timeout=2)
             region = response.json()['region']
 
         return region
+
+
+# supported providers and the handler class for each; resolved once at
+# import time instead of branching on the name per call
+_PROVIDERS = {
+    'on-prem': DataHandler,
+    'aws': AWSDataHandler,
+}
+
+_SUPPORTED_PROVIDERS = tuple(_PROVIDERS)
+
+
+def supported_providers():
+    """Return the names of the supported data providers."""
+    return _SUPPORTED_PROVIDERS